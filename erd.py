@@ -2,58 +2,230 @@
 
 import argparse
 import fnmatch
-import glob
 import os
 import re
 import shlex
 import stat
 import sys
-from dataclasses import dataclass
-from typing import Iterator
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import cached_property, lru_cache
+from typing import Callable, Iterable, Iterator
 
 import igittigitt.igittigitt
-import wcmatch
+import pathspec
 from dircolors import Dircolors
+from lru import LRU
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+from gitignore import GitRootSearch
 
 
 XDG_CONFIG_HOME = os.getenv("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
 DEFAULT_RC_FILE = os.getenv("ERD_RC", os.path.join(XDG_CONFIG_HOME, "erd.rc"))
 DIRCOLORS = Dircolors()
+GIT_ROOT_SEARCH = GitRootSearch()
+FORMAT_CACHE = LRU(4096)
+DEFAULT_STAT_THREADS = 0
+GLOB_MAGIC = re.compile(r"[*?[]")
+GLOB_SPECIAL = re.compile(r"[*?[\\]")
+# Rule globs of the form "<base>/**/<name>", "<base>/**/<name>/" and
+# "<base>/**/*<.ext>", with no glob characters in base, name or ext.
+LITERAL_RULE = re.compile(
+    r"(?P<base>[^*?[\]\\]*)/\*\*/"
+    r"(?:(?P<name>[^/*?[\]\\]+)(?P<dir>/?)|\*(?P<suffix>\.[^/*?[\]\\]+))"
+)
+S_IXANY = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+MODE_SUFFIXES = {stat.S_IFDIR: "/", stat.S_IFIFO: "|", stat.S_IFSOCK: "="}
+# S_IFDOOR is 0 on platforms without doors.
+if stat.S_IFDOOR:
+    MODE_SUFFIXES[stat.S_IFDOOR] = ">"
+
+
+def compile_re2_matcher(spec: pathspec.PathSpec) -> Callable[[str], bool | None]:
+    patterns = [p for p in spec.patterns if p.include is not None]
+    if not patterns:
+        return lambda file_path: None
+
+    # An RE2 set matches every rule in one linear-time pass and reports all of
+    # the rules that matched.
+    rules = re2.Set.MatchSet()
+    for p in patterns:
+        rules.Add(p.regex.pattern)
+    rules.Compile()
+    include = [p.include for p in patterns]
+
+    def match(file_path: str) -> bool | None:
+        matched = rules.Match(pathspec.util.normalize_file(file_path))
+        # As in git, the last matching rule wins.
+        return include[max(matched)] if matched else None
+
+    return match
+
+
+def make_ignore_matcher(lines: tuple[str, ...]) -> Callable[[str], bool | None]:
+    # The matcher returns whether the last rule to match a path ignores it, or
+    # None if no rule matches it at all.
+    spec = pathspec.PathSpec.from_lines("gitignore", lines)
+    if re2:
+        try:
+            return compile_re2_matcher(spec)
+        except re2.error:
+            pass
+    return lambda file_path: spec.check_file(file_path).include
+
+
+@lru_cache(maxsize=64)
+def compile_ignore_matcher(lines: tuple[str, ...]) -> Callable[[str], bool | None]:
+    return make_ignore_matcher(lines)
+
+
+def rule_to_pathspec_line(rule: igittigitt.igittigitt.IgnoreRule) -> str:
+    line = rule.pattern_glob
+    # igittigitt strips the trailing slash from directory-only patterns and
+    # records it in match_file instead.
+    if not rule.match_file:
+        line = line.rstrip("/") + "/"
+    if rule.is_negation_rule:
+        line = "!" + line
+    return line
+
+
+def glob_literal_dir(glob: str) -> str:
+    # The longest leading directory path of the glob with no glob syntax in it.
+    # Nothing outside of this directory can match the glob.
+    head = GLOB_SPECIAL.split(glob, 1)[0]
+    return head[: head.rfind("/") + 1]
 
 
-class GitignoreParser:
-    ignore_rules: list[igittigitt.igittigitt.IgnoreRule] = []
-    negate_rules: list[igittigitt.igittigitt.IgnoreRule] = []
-    _patterns: tuple[re.Pattern | None, re.Pattern | None] | None = None
-
-    def _compile_patterns(self) -> tuple[re.Pattern | None, re.Pattern | None]:
-        self.ignore_rules = sorted(set(self.ignore_rules))
-        self.negate_rules = sorted(set(self.negate_rules))
-        ignore, negate = wcmatch.glob.translate(
-            [rule.pattern_glob for rule in self.ignore_rules],
-            flags=wcmatch.glob.DOTGLOB | wcmatch.glob.GLOBSTAR,
-            exclude=[rule.pattern_glob for rule in self.negate_rules],
-        )
-        ignore = "|".join(ignore)
-        negate = "|".join(negate)
-        self._patterns = (
-            re.compile(ignore) if ignore else None,
-            re.compile(negate) if negate else None,
-        )
-        return self._patterns
+@dataclass
+class LiteralRules:
+    names: set[str]
+    dir_names: set[str]
+    suffixes: tuple[str, ...]
+
+
+def compile_literal_rules(
+    lines: tuple[str, ...],
+) -> dict[tuple[str, tuple[str, ...]], LiteralRules]:
+    # A literal rule that matches settles the question unless a later negation
+    # rule could re-include the path. A negation can only match below the
+    # directory its glob is anchored to, so remember those directories and
+    # only trust the literal rule outside of them.
+    literal_rules: dict[tuple[str, tuple[str, ...]], LiteralRules] = {}
+    negated: tuple[str, ...] = ()
+    for line in reversed(lines):
+        if line.startswith("!"):
+            negated += (glob_literal_dir(line[1:]),)
+            continue
+        m = LITERAL_RULE.fullmatch(line)
+        if not m:
+            continue
+        key = (m["base"] + "/", negated)
+        literals = literal_rules.setdefault(key, LiteralRules(set(), set(), ()))
+        if m["suffix"]:
+            literals.suffixes += (m["suffix"],)
+        elif m["dir"]:
+            literals.dir_names.add(m["name"])
+        else:
+            literals.names.add(m["name"])
+    return literal_rules
+
+
+def match_literal_rules(
+    literal_rules: dict[tuple[str, tuple[str, ...]], LiteralRules], file_path: str
+) -> bool:
+    for (base, negated), literals in literal_rules.items():
+        if not file_path.startswith(base):
+            continue
+        if negated and file_path.startswith(negated):
+            continue
+        # Like the full rules, these match a component anywhere below base,
+        # and therefore everything beneath that component as well. A
+        # directory-only name has to be followed by a "/".
+        parts = file_path[len(base):].split("/")
+        if not literals.names.isdisjoint(parts):
+            return True
+        if not literals.dir_names.isdisjoint(parts[:-1]):
+            return True
+        if literals.suffixes and any(
+            part.endswith(literals.suffixes) for part in parts
+        ):
+            return True
+    return False
 
-    def match(self, file_path: str) -> bool:
-        ignore, negate = self._patterns or self._compile_patterns()
-        if ignore and re.match(ignore, file_path):
-            return not (negate and re.match(negate, file_path))
+
+class GitignoreParser:
+    def __init__(self) -> None:
+        self.rules: list[igittigitt.igittigitt.IgnoreRule] = []
+        self._literal_rules: dict[tuple[str, tuple[str, ...]], LiteralRules] = {}
+        self._matcher: Callable[[str], bool | None] | None = None
+        self._rule_dirs: frozenset[str] = frozenset()
+        self._rule_dir_parents: frozenset[str] = frozenset()
+
+    def _compile_patterns(self) -> Callable[[str], bool | None]:
+        # Rules are kept in the order they were read so that, as in git, the
+        # last matching rule decides whether a path is ignored.
+        lines = tuple(rule_to_pathspec_line(rule) for rule in self.rules)
+        self._literal_rules = compile_literal_rules(lines)
+        # Only a rule that ignores something can change what is shown, and
+        # nothing outside of its literal directory can match it.
+        rule_dirs = {
+            glob_literal_dir(rule.pattern_glob)
+            for rule in self.rules
+            if not rule.is_negation_rule
+        }
+        rule_dir_parents = set()
+        for rule_dir in rule_dirs:
+            end = rule_dir.find("/")
+            while 0 <= end < len(rule_dir) - 1:
+                rule_dir_parents.add(rule_dir[: end + 1])
+                end = rule_dir.find("/", end + 1)
+        self._rule_dirs = frozenset(rule_dirs)
+        self._rule_dir_parents = frozenset(rule_dir_parents)
+        self._matcher = compile_ignore_matcher(lines)
+        return self._matcher
+
+    def match(self, file_path: str, is_dir: bool = False) -> bool:
+        matcher = self._matcher or self._compile_patterns()
+        # Directory-only rules (e.g. "build/") need the trailing slash to match.
+        if is_dir:
+            file_path += "/"
+        # Most ignored paths are caught by a plain name or extension rule, which
+        # can be checked without running the full matcher.
+        if match_literal_rules(self._literal_rules, file_path):
+            return True
+        return bool(matcher(file_path))
+
+    def encloses(self, dirpath: str, ancestors: bool = True) -> bool:
+        """Returns whether the directory of some rule is dirpath or, unless
+        ancestors is False, one of its ancestors. Any of the rules could then
+        match below dirpath."""
+        if self._matcher is None:
+            self._compile_patterns()
+        subtree = dirpath.rstrip("/") + "/"
+        if not ancestors:
+            return subtree in self._rule_dirs
+        end = subtree.find("/")
+        while end >= 0:
+            if subtree[: end + 1] in self._rule_dirs:
+                return True
+            end = subtree.find("/", end + 1)
         return False
 
+    def has_rules_below(self, dirpath: str) -> bool:
+        """Returns whether the directory of some rule is inside of dirpath."""
+        if self._matcher is None:
+            self._compile_patterns()
+        return dirpath.rstrip("/") + "/" in self._rule_dir_parents
+
     def _add_rule(self, rule: igittigitt.igittigitt.IgnoreRule) -> None:
-        self._patterns = None
-        if rule.is_negation_rule:
-            self.negate_rules.append(rule)
-        else:
-            self.ignore_rules.append(rule)
+        self._matcher = None
+        self.rules.append(rule)
 
     def add_rule(self, pattern: str, base_dir: str) -> None:
         rules = igittigitt.igittigitt.igittigitt.get_rules_from_git_pattern(
@@ -81,60 +253,155 @@ class GitignoreParser:
                     self._add_rule(rule)
 
     def parse_rule_files(self, base_dir: str, add_default_patterns: bool = False) -> None:
+        # While discovering, each rule file gets a matcher of its own, keyed on
+        # the directory its rules apply to, so that pruning never recompiles
+        # the rules read so far. The full matcher is compiled once at the end.
+        matchers: dict[str, list[Callable[[str], bool | None]]] = {}
+
+        def parse(rule_file: str, rule_dir: str | None = None) -> None:
+            rule_dir = rule_dir or os.path.dirname(rule_file)
+            start = len(self.rules)
+            self.parse_rule_file(rule_file, rule_dir)
+            lines = tuple(rule_to_pathspec_line(r) for r in self.rules[start:])
+            if lines:
+                key = os.path.normpath(rule_dir)
+                matchers.setdefault(key, []).append(make_ignore_matcher(lines))
+
+        def ignored(dirpath: str) -> bool:
+            # Rule files deeper in the tree come later, so, as in git, the
+            # deepest file with a matching rule decides.
+            d = os.path.dirname(dirpath)
+            while True:
+                for matcher in reversed(matchers.get(d, ())):
+                    decision = matcher(dirpath + "/")
+                    if decision is not None:
+                        return decision
+                parent = os.path.dirname(d)
+                if parent == d:
+                    return False
+                d = parent
+
         if add_default_patterns:
             default_rule_file = os.path.join(XDG_CONFIG_HOME, "git", "gitignore")
             try:
-                self.parse_rule_file(default_rule_file, base_dir)
+                parse(default_rule_file, base_dir)
             except FileNotFoundError:
                 pass
 
-        rule_files = sorted(glob.glob(f"{base_dir}/**/.gitignore", recursive=True))
-        for rule_file in rule_files:
-            if not self.match(rule_file) or True:
-                self.parse_rule_file(rule_file)
+        # Walk top-down so that a directory's rules are parsed before any of
+        # its subdirectories are considered. Ignored directories are never
+        # entered, just as git never reads the .gitignore files inside them.
+        pending = [base_dir]
+        while pending:
+            d = pending.pop()
+            try:
+                with os.scandir(d) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git":
+                        subdirs.append(entry.path)
+                elif entry.name == ".gitignore" and entry.is_file(
+                    follow_symlinks=False
+                ):
+                    parse(entry.path)
+
+            subdirs = [sd for sd in subdirs if not ignored(sd)]
+            pending.extend(sorted(subdirs, reverse=True))
 
 
 def find_git_toplevel(base_dir: str) -> str | None:
-    # TODO: memoize the dir->repo mapping in a way that doesn't grow memory
-    # usage forever.
-    d = os.path.abspath(base_dir)
-    while d != "/":
-        if os.path.exists(os.path.join(d, ".git")):
-            return d
-        d = os.path.dirname(d)
-    return None
+    return GIT_ROOT_SEARCH.find_root(base_dir)
 
 
-def make_ignore_parser(base_dir: str) -> GitignoreParser | None:
-    top = find_git_toplevel(base_dir)
-    if not top:
-        return None
+@lru_cache(maxsize=None)
+def load_ignore_parser(top: str) -> GitignoreParser:
     parser = GitignoreParser()
     parser.parse_rule_files(base_dir=top, add_default_patterns=True)
+    # Compile up front rather than on first use, when the prefetch workers
+    # could all be compiling the same rules at once.
+    parser._compile_patterns()
     return parser
 
 
+def make_ignore_parser(base_dir: str) -> GitignoreParser | None:
+    # Paths in the same repository share one parser, so the rule files under
+    # a git root are only discovered and parsed once per run.
+    top = find_git_toplevel(base_dir)
+    return load_ignore_parser(top) if top else None
+
+
 class Entity:
     def __init__(self, path: str, preserve_path: bool = False) -> None:
         self.path = path
-        self.abspath = os.path.abspath(self.path)
         self.preserve_path = preserve_path
         self.dirname, self.basename = os.path.split(path)
         self.stat = os.lstat(self.path)
+        self.is_dir = stat.S_ISDIR(self.stat.st_mode)
+        self._scan: Future[list[Entity]] | None = None
+
+    @classmethod
+    def from_direntry(cls, direntry: os.DirEntry, dirname: str) -> "Entity":
+        entity = cls.__new__(cls)
+        entity.path = os.path.join(dirname, direntry.name)
+        entity.preserve_path = False
+        entity.dirname = dirname
+        entity.basename = direntry.name
+        entity.is_dir = direntry.is_dir(follow_symlinks=False)
+        try:
+            entity.stat = direntry.stat(follow_symlinks=False)
+        except OSError:
+            # Leave it to the lazy lstat, which raises when the stat is needed.
+            pass
+        entity._scan = None
+        return entity
+
+    @cached_property
+    def stat(self) -> os.stat_result:
+        return os.lstat(self.path)
+
+    @cached_property
+    def abspath(self) -> str:
+        return os.path.abspath(self.path)
 
     def __str__(self) -> str:
         return self.path
 
-    def children(self) -> list["Entity"]:
-        if not stat.S_ISDIR(self.stat.st_mode):
+    def children(self, filter: "PathFilter | None" = None) -> list["Entity"]:
+        if not self.is_dir:
             return []
 
-        children = [
-            Entity(os.path.join(self.path, child)) for child in os.listdir(self.path)
-        ]
-        children.sort(key=lambda e: (stat.S_ISDIR(e.stat.st_mode), e.basename))
+        if self._scan:
+            children = self._scan.result()
+        else:
+            children = scan_dir(self.path, filter)
+        children.sort(key=lambda e: (e.is_dir, e.basename))
         return children
 
+    @cached_property
+    def formatted(self) -> str:
+        # Hardlinks and bind mounts show the same inode under many paths, and
+        # those usually share a name too. Symlinks are excluded because a
+        # relative target is colored relative to where the link lives, and
+        # preserved paths because they include their dirname.
+        if self.preserve_path or stat.S_ISLNK(self.stat.st_mode):
+            return self.format()
+        key = (self.stat.st_dev, self.stat.st_ino, self.basename)
+        result = FORMAT_CACHE.get(key)
+        if result is None:
+            result = FORMAT_CACHE[key] = self.format()
+        return result
+
+    @cached_property
+    def formatted_ancestor(self) -> str:
+        # How this entity is drawn when a single-child chain is collapsed
+        # onto one line.
+        return self.formatted.rstrip("/") + "/"
+
     def format(self) -> str:
         if self.preserve_path:
             cwd = None
@@ -145,32 +412,95 @@ class Entity:
 
         # Add special prefixes for entities that aren't regular files.
         # NOTE: No special handling for S_ISCHR, S_ISBLK, S_ISPORT, or S_ISWHT
-        if stat.S_ISDIR(self.stat.st_mode):
-            result += "/"
-        elif stat.S_ISREG(self.stat.st_mode) and os.access(self.path, os.X_OK):
-            result += "*"
-        elif stat.S_ISFIFO(self.stat.st_mode):
-            result += "|"
-        elif stat.S_ISLNK(self.stat.st_mode):
+        mode = self.stat.st_mode
+        file_type = stat.S_IFMT(mode)
+        if file_type == stat.S_IFREG:
+            if mode & S_IXANY:
+                result += "*"
+        elif file_type == stat.S_IFLNK:
             target = os.readlink(self.path)
             result += "@ -> " + DIRCOLORS.format(target, cwd=cwd)
-        elif stat.S_ISSOCK(self.stat.st_mode):
-            result += "="
-        elif stat.S_ISDOOR(self.stat.st_mode):
-            result += ">"
+        else:
+            result += MODE_SUFFIXES.get(file_type, "")
 
         return result
 
 
+def scan_dir(path: str, filter: "PathFilter | None" = None) -> list[Entity]:
+    # Scanning through a directory fd makes DirEntry use fstatat() relative to
+    # it, so the kernel doesn't resolve the full path again for every entry.
+    # The entries keep using that fd, so they are all stat'd before it closes.
+    # Every entry that survives the filter is displayed, so nothing is stat'd
+    # that wouldn't have been anyway.
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        with os.scandir(fd) as it:
+            entries = list(it)
+        if filter:
+            # Everything the filter looks at is available from the directory
+            # entry itself, so rejected entries never cost a stat.
+            dirpath = os.path.abspath(path)
+            match_name = filter.match_name
+            entries = [
+                entry
+                for entry in entries
+                if match_name(
+                    dirpath, entry.name, entry.is_dir(follow_symlinks=False)
+                )
+            ]
+        from_direntry = Entity.from_direntry
+        return [from_direntry(entry, path) for entry in entries]
+    finally:
+        os.close(fd)
+
+
+def prefetch(
+    entity: Entity, executor: Executor, filter: "PathFilter | None" = None
+) -> None:
+    """Start listing (and stat'ing) a directory's contents before the walk
+    descends into it."""
+    if entity.is_dir and not entity._scan:
+        entity._scan = executor.submit(scan_dir, entity.path, filter)
+
+
+@lru_cache(maxsize=None)
+def compile_glob(pattern: str) -> re.Pattern:
+    # Unlike fnmatch's internal cache this is unbounded, so a large set of
+    # include/exclude patterns can't evict each other.
+    return re.compile(fnmatch.translate(pattern))
+
+
 class PathMatch:
     def __init__(self, expression: str):
         self.pattern = expression.rstrip("/")
         self.is_dir = expression.endswith("/")
+        self._match = self._compile(self.pattern)
+
+    @staticmethod
+    def _compile(pattern: str) -> Callable[[str], object]:
+        # Most patterns are a literal name or a literal with a leading and/or
+        # trailing "*"; those don't need the regex engine at all.
+        if not GLOB_MAGIC.search(pattern):
+            return lambda s: s == pattern
+        if pattern.startswith("*"):
+            rest = pattern[1:]
+            if not GLOB_MAGIC.search(rest):
+                return lambda s: s.endswith(rest)
+            if rest.endswith("*") and not GLOB_MAGIC.search(rest[:-1]):
+                middle = rest[:-1]
+                return lambda s: middle in s
+        elif pattern.endswith("*") and not GLOB_MAGIC.search(pattern[:-1]):
+            head = pattern[:-1]
+            return lambda s: s.startswith(head)
+        return compile_glob(pattern).match
 
     def __call__(self, entity: Entity) -> bool:
-        if self.is_dir and not stat.S_ISDIR(entity.stat.st_mode):
+        return self.match_name(entity.basename, entity.is_dir)
+
+    def match_name(self, name: str, is_dir: bool) -> bool:
+        if self.is_dir and not is_dir:
             return False
-        return fnmatch.fnmatch(entity.basename, self.pattern)
+        return bool(self._match(name))
 
     def __str__(self) -> str:
         return f"{self.pattern}{'/' if self.is_dir else ''}"
@@ -181,15 +511,48 @@ class PathFilter:
     include: list[PathMatch]
     exclude: list[PathMatch]
     gitignore: GitignoreParser | None
+    # Set once the directory of some gitignore rule encloses the filtered
+    # subtree. Any of the rules could match below it from then on, so there is
+    # nothing left to specialize.
+    gitignore_enclosed: bool = False
 
     def __call__(self, entity: Entity) -> bool:
+        dirpath, name = os.path.split(entity.abspath)
+        return self.match_name(dirpath, name, entity.is_dir)
+
+    @property
+    def specializes(self) -> bool:
+        return self.gitignore is not None and not self.gitignore_enclosed
+
+    def for_root(self, entity: Entity) -> "PathFilter":
+        """Returns a filter for the contents of entity, where a walk starts."""
+        if self.specializes and self.gitignore.encloses(entity.abspath):
+            return replace(self, gitignore_enclosed=True)
+        return self.for_subtree(entity)
+
+    def for_subtree(self, entity: Entity) -> "PathFilter":
+        """Returns a filter for the contents of entity, one of the directories
+        this filter applies to, that skips the gitignore rules if none of them
+        can match anywhere below it."""
+        if not self.specializes:
+            return self
+        # None of the rule directories enclose the parent, so only entity itself
+        # could be one.
+        dirpath = entity.abspath
+        if self.gitignore.encloses(dirpath, ancestors=False):
+            return replace(self, gitignore_enclosed=True)
+        if self.gitignore.has_rules_below(dirpath):
+            return self
+        return replace(self, gitignore=None)
+
+    def match_name(self, dirpath: str, name: str, is_dir: bool) -> bool:
         retain = True
         if self.include:
-            retain = any(pmatch(entity) for pmatch in self.include)
+            retain = any(pmatch.match_name(name, is_dir) for pmatch in self.include)
         if retain and self.exclude:
-            retain = not any(pmatch(entity) for pmatch in self.exclude)
+            retain = not any(pmatch.match_name(name, is_dir) for pmatch in self.exclude)
         if retain and self.gitignore:
-            retain = not self.gitignore.match(entity.abspath)
+            retain = not self.gitignore.match(os.path.join(dirpath, name), is_dir)
         return retain
 
 
@@ -201,6 +564,7 @@ def make_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument("--gitignore", dest="gitignore", action="store_true")
     parser.add_argument("--no-gitignore", dest="gitignore", action="store_false")
     parser.set_defaults(gitignore=False)
+    parser.add_argument("--stat-threads", type=int, default=DEFAULT_STAT_THREADS)
     return parser
 
 
@@ -232,42 +596,77 @@ def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     return parser.parse_args(argv)
 
 
+PREFETCH_LOOKAHEAD = 16
 def tree_walk(
-    entity: Entity,
-    ancestors: list[Entity],
-    filter: PathFilter,
-    prefix: str,
-    indent: str,
-    last_sibling: bool,
+    entity: Entity, filter: PathFilter, executor: Executor | None
 ) -> Iterator[str]:
-    children = [c for c in entity.children() if filter(c)]
-    if len(children) == 1:
-        ancestors.append(entity)
-        yield from tree_walk(
-            children[0], ancestors, filter, prefix, indent, last_sibling
-        )
-        return
-
-    line = ""
-    line += prefix
-    line += indent
-    for ancestor in ancestors:
-        line += ancestor.format().rstrip("/")
-        line += "/"
-    line += entity.format()
-    yield line
-
-    if prefix or indent:
-        prefix += "    " if last_sibling else "│   "
-
-    for child in children[:-1]:
-        yield from tree_walk(child, [], filter, prefix, "├── ", False)
-    for child in children[-1:]:
-        yield from tree_walk(child, [], filter, prefix, "└── ", True)
-
-
-def tree(entity: Entity, filter: PathFilter) -> Iterator[str]:
-    yield from tree_walk(entity, [], filter, "", "", True)
+    # Each frame is (entity, filter, prefix, indent, last_sibling), where filter
+    # is specialized for the entity's contents. Frames are pushed in reverse so
+    # that siblings pop off the stack in display order.
+    stack = [(entity, filter.for_root(entity), "", "", True)]
+    # This loop runs once per visible directory entry, so keep the names it
+    # uses in locals rather than looking them up as globals or attributes.
+    pop, push, extend = stack.pop, stack.append, stack.extend
+    join = "".join
+    prefetch_ = prefetch
+    while stack:
+        entity, filter, prefix, indent, last_sibling = pop()
+
+        # Fold single-child directory chains onto one line.
+        ancestors = []
+        children = entity.children(filter)
+        while len(children) == 1:
+            ancestors.append(entity)
+            entity = children[0]
+            filter = filter.for_subtree(entity)
+            children = entity.children(filter)
+
+        parts = [prefix, indent]
+        parts.extend(ancestor.formatted_ancestor for ancestor in ancestors)
+        parts.append(entity.formatted)
+        yield join(parts)
+
+        if prefix or indent:
+            prefix += "    " if last_sibling else "│   "
+
+        if children and filter.specializes:
+            filters = [
+                filter.for_subtree(child) if child.is_dir else filter
+                for child in children
+            ]
+            push((children[-1], filters[-1], prefix, "└── ", True))
+            extend(
+                (child, child_filter, prefix, "├── ", False)
+                for child, child_filter in zip(
+                    reversed(children[:-1]), reversed(filters[:-1])
+                )
+            )
+        elif children:
+            push((children[-1], filter, prefix, "└── ", True))
+            extend(
+                (child, filter, prefix, "├── ", False)
+                for child in reversed(children[:-1])
+            )
+
+        # Start listing the next few directories off the top of the stack.
+        # Listings that finish too far ahead of the walk would just sit in
+        # memory, so more are only submitted as frames are popped.
+        if executor and entity.is_dir:
+            lookahead = PREFETCH_LOOKAHEAD
+            for frame in reversed(stack):
+                # Files sort first, so only this directory's own files can sit
+                # above the directories waiting on the stack.
+                if frame[0].is_dir:
+                    prefetch_(frame[0], executor, frame[1])
+                    lookahead -= 1
+                    if not lookahead:
+                        break
+
+
+def tree(
+    entity: Entity, filter: PathFilter, executor: Executor | None = None
+) -> Iterator[str]:
+    yield from tree_walk(entity, filter, executor)
 
 
 FLUSH_EVERY_N = 50
@@ -281,20 +680,49 @@ def write_line(line: str) -> None:
         sys.stdout.flush()
 
 
+WRITE_CHUNK_LINES = 4096
+def write_lines(lines: Iterable[str]) -> None:
+    # Keep interactive output flowing line by line. Otherwise stdout is already
+    # block-buffered, so hand it large chunks instead of one write per line.
+    if sys.stdout.isatty():
+        for line in lines:
+            write_line(line)
+        return
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == WRITE_CHUNK_LINES:
+            sys.stdout.write("\n".join(chunk) + "\n")
+            chunk.clear()
+    if chunk:
+        sys.stdout.write("\n".join(chunk) + "\n")
+
+
 def main(argv: list[str] | None = None):
     args = parse_args(argv)
 
     include = [PathMatch(expr) for expr in args.include.split("|") if expr.strip()]
     exclude = [PathMatch(expr) for expr in args.exclude.split("|") if expr.strip()]
 
-    for path in args.paths:
-        path = os.path.expanduser(path)
-        entity = Entity(path, preserve_path=True)
-        base_dir = path if os.path.isdir(path) else os.path.dirname(path)
-        gitignore = make_ignore_parser(base_dir) if args.gitignore else None
-        filter = PathFilter(include=include, exclude=exclude, gitignore=gitignore)
-        for line in tree(entity, filter):
-            write_line(line)
+    # The prefetch pool only pays off when listing a directory is slow, as on
+    # network or cold storage. When the listings are already cached, handing
+    # them between threads costs more than it saves, so it is opt-in.
+    executor = None
+    if args.stat_threads > 0:
+        executor = ThreadPoolExecutor(max_workers=args.stat_threads)
+
+    try:
+        for path in args.paths:
+            path = os.path.expanduser(path)
+            entity = Entity(path, preserve_path=True)
+            base_dir = path if os.path.isdir(path) else os.path.dirname(path)
+            gitignore = make_ignore_parser(base_dir) if args.gitignore else None
+            filter = PathFilter(include=include, exclude=exclude, gitignore=gitignore)
+            write_lines(tree(entity, filter, executor))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ import os
 from dataclasses import dataclass
 from functools import lru_cache
 
-from lru import LruDict
+from lru import LRU
 
 """
 TODO:
@@ -41,7 +41,7 @@ def git_root_ceilings() -> set[str]:
         sym_ceilings, nonsym_ceilings = ceilings[:i], ceilings[i+1:]
     except ValueError:
         pass
-    resolved_ceilings = {os.readlink(path) for path in sym_ceilings}
+    resolved_ceilings = {os.path.realpath(path) for path in sym_ceilings}
     resolved_ceilings.update(nonsym_ceilings)
     return resolved_ceilings
 
@@ -50,18 +50,18 @@ def git_root_ceilings() -> set[str]:
 def git_root_override() -> str | None:
     git_work_tree = os.getenv("GIT_WORK_TREE")
     if git_work_tree:
-        return git_work_tree
+        return os.path.abspath(git_work_tree)
 
     git_dir = os.getenv("GIT_DIR")
     if git_dir:
-        return os.path.dirname(git_dir)
+        return os.path.abspath(os.path.dirname(git_dir))
 
     return None
 
 
 @lru_cache(1)
 def git_root_search_terminals() -> set[str]:
-    terminals = {"/", os.path.expanduser("~")}
+    terminals = {"/"}
     terminals.update(git_root_ceilings())
     return terminals
 
@@ -70,26 +70,41 @@ class GitRootSearch:
     def __init__(self, cache_max_count=1024):
         self.override = git_root_override()
         self.terminals = git_root_search_terminals()
-        self.find_root_cache: LruDict[str, str | None] = LruDict(cache_max_count)
+        self.find_root_cache = LRU(cache_max_count)
 
     def find_root(self, start_dir: str) -> str | None:
-        if self.override:
+        start_dir = os.path.abspath(start_dir)
+        # The override only names the root of the paths inside of it. Anything
+        # else is found by searching as usual.
+        if self.override and (
+            start_dir == self.override
+            or start_dir.startswith(self.override.rstrip(os.sep) + os.sep)
+        ):
             return self.override
-        return self._find_root(os.path.abspath(start_dir))
+        return self._find_root(start_dir)
 
     def _find_root(self, d: str) -> str | None:
-        if d in self.find_root_cache:
-            return self.find_root_cache[d]
-
-        if os.path.exists(os.path.join(d, ".git")):
-            self.find_root_cache[d] = d
-            return d
-
-        if d in self.terminals:
-            self.find_root_cache[d] = None
-            return None
-
-        return self._find_root(os.path.dirname(d))
+        # Every directory visited on the way up shares the same answer, so
+        # cache all of them rather than just the one the search ended on.
+        visited = []
+        root = None
+        while True:
+            if d in self.find_root_cache:
+                root = self.find_root_cache[d]
+                break
+            visited.append(d)
+            if os.path.lexists(os.path.join(d, ".git")):
+                root = d
+                break
+            if d in self.terminals:
+                break
+            # d is already normalized by abspath, so its parent is everything
+            # before the last separator.
+            d = d[:d.rindex(os.sep)] or os.sep
+
+        for v in visited:
+            self.find_root_cache[v] = root
+        return root
 
 
 @dataclass
@@ -0,0 +1,208 @@
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import pathspec
+
+import erd
+
+RULE_BASES = ["/r", "/r/s", "/r/s/t"]
+RULE_PATTERNS = [
+    "node_modules",
+    "*.pyc",
+    "build/",
+    "*.log",
+    "!keep.log",
+    "dist",
+    "x*y",
+    "/abs",
+    "a/b",
+    "*.tar.gz",
+    "!node_modules",
+    ".venv/",
+    "**/cache",
+    "foo/**/bar",
+    "?z",
+    "!build/",
+    "!*.log",
+    "b/",
+    "a*",
+    "*.txt",
+]
+PATH_COMPONENTS = [
+    "node_modules",
+    "a.pyc",
+    "build",
+    "keep.log",
+    "x.log",
+    "dist",
+    "xay",
+    "abs",
+    "a",
+    "b",
+    "f.tar.gz",
+    ".venv",
+    "cache",
+    "foo",
+    "bar",
+    "zz",
+    "s",
+    "t",
+    "c.txt",
+]
+
+
+def write_files(root: str, files: dict[str, str]) -> None:
+    for path, content in files.items():
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def visible_files(root: str, parser: erd.GitignoreParser) -> set[str]:
+    filter = erd.PathFilter(include=[], exclude=[], gitignore=parser)
+    files = set()
+    pending = [root]
+    while pending:
+        for child in erd.scan_dir(pending.pop(), filter):
+            if not child.is_dir:
+                files.add(os.path.relpath(child.path, root))
+            elif child.basename != ".git":
+                pending.append(child.path)
+    return files
+
+
+class BackendTestCase(unittest.TestCase):
+    """Runs each test with the RE2 matcher, when it is installed, and with
+    pathspec's own matcher."""
+
+    def run_backends(self, test) -> None:
+        backends = [("pathspec", None)]
+        if erd.re2:
+            backends.append(("re2", erd.re2))
+        for name, re2 in backends:
+            with self.subTest(backend=name), mock.patch.object(erd, "re2", re2):
+                erd.compile_ignore_matcher.cache_clear()
+                try:
+                    test()
+                finally:
+                    erd.compile_ignore_matcher.cache_clear()
+
+
+class TestMatch(BackendTestCase):
+    def test_matches_pathspec(self) -> None:
+        self.run_backends(self.check_random_rules)
+
+    def check_random_rules(self) -> None:
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            rule_file = os.path.join(tmp, ".gitignore")
+            for _ in range(300):
+                parser = erd.GitignoreParser()
+                for _ in range(rng.randint(1, 8)):
+                    with open(rule_file, "w") as f:
+                        f.write(rng.choice(RULE_PATTERNS) + "\n")
+                    parser.parse_rule_file(rule_file, rng.choice(RULE_BASES))
+
+                lines = [erd.rule_to_pathspec_line(rule) for rule in parser.rules]
+                spec = pathspec.PathSpec.from_lines("gitignore", lines)
+                for _ in range(50):
+                    components = rng.choices(PATH_COMPONENTS, k=rng.randint(1, 5))
+                    path = "/r/" + "/".join(components)
+                    is_dir = rng.random() < 0.5
+                    expected = spec.check_file(path + ("/" if is_dir else "")).include
+                    self.assertEqual(
+                        parser.match(path, is_dir),
+                        bool(expected),
+                        (lines, path, is_dir),
+                    )
+
+
+@unittest.skipUnless(shutil.which("git"), "git is not installed")
+class TestAgainstGit(BackendTestCase):
+    FILES = {
+        ".gitignore": "*.log\n!keep.log\nbuild/\n/only-top\nnode_modules\ncache/\n",
+        "keep.log": "",
+        "x.log": "",
+        "only-top/f": "",
+        "a/only-top/f": "",
+        # Directory-only rules must not match files.
+        "a/build": "",
+        "a/b/build/out.o": "",
+        # git never reads the rule files inside an ignored directory.
+        "node_modules/.gitignore": "!*\n",
+        "node_modules/pkg/index.js": "",
+        "cache/.gitignore": "!*\n",
+        "cache/data": "",
+        "sub/.gitignore": "*.o\n!keep.o\nvendor/\n!x.log\n",
+        "sub/x.o": "",
+        "sub/keep.o": "",
+        "sub/x.log": "",
+        "sub/vendor/.gitignore": "!*.o\n",
+        "sub/vendor/y.o": "",
+        # Rules in deeper files override the ones above them.
+        "sub/deep/.gitignore": "!z.o\nkeep.o\n",
+        "sub/deep/z.o": "",
+        "sub/deep/keep.o": "",
+        "sub/deep/vendor": "",
+    }
+
+    def test_matches_git(self) -> None:
+        self.run_backends(self.check_fixture)
+
+    def check_fixture(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "repo")
+            write_files(root, self.FILES)
+            env = dict(
+                os.environ,
+                HOME=tmp,
+                XDG_CONFIG_HOME=tmp,
+                GIT_CONFIG_NOSYSTEM="1",
+            )
+            subprocess.run(["git", "init", "-q", root], check=True, env=env)
+            expected = subprocess.run(
+                ["git", "ls-files", "--others", "--exclude-standard", "-z"],
+                cwd=root,
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split("\0")
+
+            parser = erd.GitignoreParser()
+            parser.parse_rule_files(root)
+            self.assertEqual(visible_files(root, parser), set(filter(None, expected)))
+
+            # Unlike the walk, check-ignore also reports on paths inside ignored
+            # directories, which only stay ignored if discovery never read the
+            # rule files in there.
+            paths = set()
+            for path in self.FILES:
+                while path:
+                    paths.add(path)
+                    path = os.path.dirname(path)
+            ignored = subprocess.run(
+                ["git", "check-ignore", "--stdin", "-z"],
+                cwd=root,
+                env=env,
+                input="\0".join(sorted(paths)),
+                capture_output=True,
+                text=True,
+            ).stdout.split("\0")
+            for path in sorted(paths):
+                abspath = os.path.join(root, path)
+                with self.subTest(path=path):
+                    self.assertEqual(
+                        parser.match(abspath, os.path.isdir(abspath)),
+                        path in ignored,
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()